@@ -1,99 +1,267 @@
+import glob
+import math
+import numbers
+import os
+import tempfile
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
 import pandas as pd
 import numpy as np
 import yfinance as yf
 import streamlit as st
 
+# Number of concurrent Yahoo Finance requests; wider pools mostly trade latency for rate limiting
+MAX_WORKERS = 16
+
+# Directory, owned by this app, holding the daily on-disk cache of fetched stock data
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'sp500_cache')
+
+# Largest fraction of tickers that may fail to fetch before the result is considered too incomplete to cache
+MAX_FAILED_FRACTION = 0.1
+
+# Seconds a fetch is reused before retrying, which bounds how long an incomplete fetch is served
+FETCH_TTL = 900
+
+# Fundamental metrics that are min-max normalized before scoring
+METRIC_COLUMNS = ['P/E Ratio', 'P/B Ratio', 'P/S Ratio', 'ROE', 'ROA', 'Debt to Equity']
+
+# Yahoo Finance info key backing each metric column
+METRIC_KEYS = {
+    'P/E Ratio': 'trailingPE',
+    'P/B Ratio': 'priceToBook',
+    'P/S Ratio': 'priceToSalesTrailing12Months',
+    'ROE': 'returnOnEquity',
+    'ROA': 'returnOnAssets',
+    'Debt to Equity': 'debtToEquity'
+}
+
+# Factor and composite scores, and the rank column derived from each
+SCORE_COLUMNS = ['Value Score', 'Quality Score', 'Momentum Score', 'Volatility Score', 'Composite Score']
+RANK_COLUMNS = [column.replace('Score', 'Rank') for column in SCORE_COLUMNS]
+
+# Decile labels for the composite score, from lowest to highest
+RANK_PERCENTAGE_LABELS = [
+    'Bottom 10%', 'Bottom 20%', 'Bottom 30%', 'Bottom 40%', 'Bottom 50%',
+    'Top 50%', 'Top 40%', 'Top 30%', 'Top 20%', 'Top 10%'
+]
+
+# Weight of each normalized metric (rows) in the value, quality, momentum and volatility scores (columns)
+FACTOR_WEIGHTS = np.array([
+    [0.5, 0.0, 0.0, 0.0],  # P/E Ratio
+    [0.5, 0.0, 0.0, 0.0],  # P/B Ratio
+    [0.0, 0.0, 1.0, 0.0],  # P/S Ratio
+    [0.0, 0.5, 0.0, 0.0],  # ROE
+    [0.0, 0.5, 0.0, 0.0],  # ROA
+    [0.0, 0.0, 0.0, 1.0],  # Debt to Equity
+])
+
+# Weight of each factor score in the composite score
+COMPOSITE_WEIGHTS = np.array([0.3, 0.3, 0.3, 0.1])
+
+# Maps the normalized metrics straight to every column of SCORE_COLUMNS
+SCORE_WEIGHTS = np.column_stack([FACTOR_WEIGHTS, FACTOR_WEIGHTS @ COMPOSITE_WEIGHTS]).astype(np.float32)
+
 # Fetch data from Yahoo Finance
-@st.cache
 def fetch_data(ticker):
-    stock = yf.Ticker(ticker)
-    info = stock.info
+    # yfinance raises its own rate-limit errors as well as curl_cffi HTTP errors, so catch broadly
+    # and flag a single failed ticker as not fetched instead of aborting the whole fetch
+    try:
+        info = yf.Ticker(ticker).info
+    except Exception as exc:
+        warnings.warn(f"Failed to fetch data for {ticker}: {exc}")
+        info = {}
     return {
+        'fetched': bool(info),
         'longName': info.get('longName', 'N/A'),
         'sector': info.get('sector', 'N/A'),
         'industry': info.get('industry', 'N/A'),
         'marketCap': info.get('marketCap', 0),
-        'trailingPE': info.get('trailingPE', 0),
-        'priceToBook': info.get('priceToBook', 0),
-        'priceToSalesTrailing12Months': info.get('priceToSalesTrailing12Months', 0),
-        'returnOnEquity': info.get('returnOnEquity', 0),
-        'returnOnAssets': info.get('returnOnAssets', 0),
-        'debtToEquity': info.get('debtToEquity', 0)
+        # Metrics Yahoo omits (e.g. trailingPE for loss-making companies) stay missing for to_metric
+        'trailingPE': info.get('trailingPE'),
+        'priceToBook': info.get('priceToBook'),
+        'priceToSalesTrailing12Months': info.get('priceToSalesTrailing12Months'),
+        'returnOnEquity': info.get('returnOnEquity'),
+        'returnOnAssets': info.get('returnOnAssets'),
+        'debtToEquity': info.get('debtToEquity'),
+        'longBusinessSummary': info.get('longBusinessSummary', 'N/A')
     }
 
-# Define a function to fetch data for all S&P 500 stocks
+# Convert a Yahoo Finance metric to a float, treating missing, non-numeric or infinite values as NaN
+def to_metric(value):
+    if isinstance(value, numbers.Real) and not isinstance(value, bool) and math.isfinite(value):
+        return float(value)
+    return np.nan
+
+# Raised when too many tickers failed to fetch for the result to be cached for the day
+class IncompleteFetchError(Exception):
+    pass
+
+# Whether a fetch with this many failures out of the total is too incomplete to cache for the day
+def too_many_failures(failed, total):
+    return failed > MAX_FAILED_FRACTION * total
+
+# Fetch data for many tickers concurrently, since each lookup is network bound
+def fetch_all(tickers):
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        return dict(zip(tickers, executor.map(fetch_data, tickers)))
+
+# Define a function to fetch data for all S&P 500 stocks, cached for a week
+@st.cache_data(ttl=604800)
 def get_sp500_tickers():
-    url = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
-    tables = pd.read_html(url)
-    df = tables[0]
+    url = "https://raw.githubusercontent.com/datasets/s-and-p-500-companies/master/data/constituents.csv"
+    df = pd.read_csv(url)
+    # Yahoo Finance uses dashes for share classes, e.g. BRK-B rather than BRK.B
+    df['Symbol'] = df['Symbol'].str.replace('.', '-', regex=False)
     return df['Symbol'].tolist(), df[['Symbol', 'Security', 'GICS Sector']]
 
-# Fetch S&P 500 tickers
-tickers, stock_info = get_sp500_tickers()
-
-# Create an empty DataFrame to store stock data
-data = []
-
-# Fetch data for each stock
-for ticker in tickers:
-    info = fetch_data(ticker)
-    data.append([
-        ticker,
-        info['longName'],
-        info['sector'],
-        info['trailingPE'],
-        info['priceToBook'],
-        info['priceToSalesTrailing12Months'],
-        info['returnOnEquity'],
-        info['returnOnAssets'],
-        info['debtToEquity']
-    ])
-
-# Convert the data into a DataFrame
-df = pd.DataFrame(data, columns=[
-    'Ticker', 'Name', 'Sector', 'P/E Ratio', 'P/B Ratio', 'P/S Ratio', 'ROE', 'ROA', 'Debt to Equity'
-])
+# Fetch raw data for all S&P 500 stocks along with the number of tickers that failed. Complete fetches are
+# persisted to Parquet so app restarts skip the network for the day; the in-memory cache is kept short so
+# an incomplete fetch is retried rather than served all day
+@st.cache_data(ttl=FETCH_TTL)
+def load_stock_data() -> tuple[pd.DataFrame, int]:
+    cache_path = os.path.join(CACHE_DIR, f"sp500_{date.today():%Y%m%d}.parquet")
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path), 0
 
-# Normalize metrics
-df['P/E Ratio'] = (df['P/E Ratio'] - df['P/E Ratio'].min()) / (df['P/E Ratio'].max() - df['P/E Ratio'].min())
-df['P/B Ratio'] = (df['P/B Ratio'] - df['P/B Ratio'].min()) / (df['P/B Ratio'].max() - df['P/B Ratio'].min())
-df['P/S Ratio'] = (df['P/S Ratio'] - df['P/S Ratio'].min()) / (df['P/S Ratio'].max() - df['P/S Ratio'].min())
-df['ROE'] = (df['ROE'] - df['ROE'].min()) / (df['ROE'].max() - df['ROE'].min())
-df['ROA'] = (df['ROA'] - df['ROA'].min()) / (df['ROA'].max() - df['ROA'].min())
-df['Debt to Equity'] = (df['Debt to Equity'] - df['Debt to Equity'].min()) / (df['Debt to Equity'].max() - df['Debt to Equity'].min())
-
-# Calculate scores
-df['Value Score'] = 0.5 * df['P/E Ratio'] + 0.5 * df['P/B Ratio']
-df['Quality Score'] = 0.5 * df['ROE'] + 0.5 * df['ROA']
-df['Momentum Score'] = df['P/S Ratio']
-df['Volatility Score'] = df['Debt to Equity']
-
-# Composite score
-df['Composite Score'] = 0.3 * df['Value Score'] + 0.3 * df['Quality Score'] + 0.3 * df['Momentum Score'] + 0.1 * df['Volatility Score']
-
-# Calculate rank for each factor and composite score
-df['Value Rank'] = df['Value Score'].rank(ascending=False).astype(int)
-df['Quality Rank'] = df['Quality Score'].rank(ascending=False).astype(int)
-df['Momentum Rank'] = df['Momentum Score'].rank(ascending=False).astype(int)
-df['Volatility Rank'] = df['Volatility Score'].rank(ascending=False).astype(int)
-df['Composite Rank'] = df['Composite Score'].rank(ascending=False).astype(int)
-
-# Calculate rank in percentage terms
-df['Rank'] = df['Composite Score'].rank(pct=True)
-df['Rank Percentage'] = pd.cut(df['Rank'], bins=np.linspace(0, 1, 11), labels=[
-    'Bottom 10%', 'Bottom 20%', 'Bottom 30%', 'Bottom 40%', 'Bottom 50%',
-    'Top 50%', 'Top 40%', 'Top 30%', 'Top 20%', 'Top 10%'
-])
+    # Fetch S&P 500 tickers
+    tickers, stock_info = get_sp500_tickers()
+
+    # Fetch data for each stock, leaving failed tickers out so their placeholder values
+    # neither get ranked nor shift the min-max range of the real stocks
+    all_info = fetch_all(tickers)
+    fetched = [ticker for ticker in tickers if all_info[ticker]['fetched']]
+    failed = len(tickers) - len(fetched)
+
+    # Pre-allocate the string metadata columns and a contiguous float32 matrix of metrics
+    n = len(fetched)
+    names = np.empty(n, dtype=object)
+    sectors = np.empty(n, dtype=object)
+    profiles = np.empty(n, dtype=object)
+    metrics = np.empty((n, len(METRIC_COLUMNS)), dtype=np.float32)
+
+    for i, ticker in enumerate(fetched):
+        info = all_info[ticker]
+        names[i] = info['longName']
+        sectors[i] = info['sector']
+        profiles[i] = info['longBusinessSummary']
+        metrics[i] = [to_metric(info[METRIC_KEYS[column]]) for column in METRIC_COLUMNS]
+
+    raw = pd.DataFrame({
+        'Ticker': fetched,
+        'Name': names,
+        'Sector': sectors,
+        'Business Profile': profiles,
+        **dict(zip(METRIC_COLUMNS, metrics.T))
+    })
+
+    # Don't persist a badly incomplete fetch, so it is not reloaded from disk after a restart
+    if too_many_failures(failed, len(tickers)):
+        warnings.warn(f"Fetching failed for {failed} of {len(tickers)} tickers; not caching the result to disk")
+        return raw, failed
+
+    # Write to a temporary file first so an interrupted write never leaves a truncated cache behind
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    partial_path = cache_path + '.partial'
+    raw.to_parquet(partial_path, compression='snappy')
+    os.replace(partial_path, cache_path)
+
+    # Remove caches, and partial writes left by interrupted runs, from previous days
+    stale = glob.glob(os.path.join(CACHE_DIR, 'sp500_????????.parquet'))
+    stale += glob.glob(os.path.join(CACHE_DIR, 'sp500_????????.parquet.partial'))
+    for path in stale:
+        if path not in (cache_path, partial_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return raw, failed
 
-# Drop unnecessary columns
-df = df[['Ticker', 'Name', 'Sector', 'Composite Rank', 'Rank Percentage', 'Value Rank', 'Quality Rank', 'Momentum Rank', 'Volatility Rank']]
+# Rank the fetched stocks on each factor and the composite score
+def rank_stocks(raw: pd.DataFrame) -> pd.DataFrame:
+    metrics = raw[METRIC_COLUMNS].to_numpy(dtype=np.float32)
 
-# Reset the index to avoid an unnamed index column
-df.reset_index(drop=True, inplace=True)
+    # Normalize metrics to [0, 1] in a single pass over the matrix
+    lo = np.nanmin(metrics, axis=0)
+    span = np.nanmax(metrics, axis=0) - lo
+    normalized = (metrics - lo) / np.where(span == 0, 1, span)
+
+    # Calculate factor and composite scores in one matrix product, keeping missing metrics missing
+    missing = np.isnan(normalized)
+    scores = np.where(missing, 0, normalized) @ SCORE_WEIGHTS
+    scores[missing @ (SCORE_WEIGHTS != 0)] = np.nan
+
+    # Calculate rank for each factor and composite score in one call over the stacked scores,
+    # leaving stocks with a missing score unranked (shown as a blank cell)
+    rank_values = pd.DataFrame(scores, columns=RANK_COLUMNS).rank(ascending=False)
+    ranks = np.trunc(rank_values).astype('Int64')
+
+    # Calculate rank in percentage terms from the tie-averaged composite rank, so tied stocks share a
+    # bucket and unranked stocks get no label; matches rank(pct=True) binned into right-closed deciles
+    composite_rank = rank_values['Composite Rank'].to_numpy()
+    ranked = ~np.isnan(composite_rank)
+    n_ranked = max(int(ranked.sum()), 1)
+    # Ten times the ascending rank, which is integral since averaged ranks are multiples of 0.5
+    scaled = np.rint((n_ranked + 1 - composite_rank[ranked]) * len(RANK_PERCENTAGE_LABELS)).astype(int)
+    codes = np.full(len(composite_rank), -1)
+    codes[ranked] = (scaled - 1) // n_ranked
+    rank_percentage = pd.Categorical.from_codes(codes, categories=RANK_PERCENTAGE_LABELS, ordered=True)
+
+    # Build only the displayed columns, so scores never become DataFrame columns
+    return pd.DataFrame({
+        'Ticker': raw['Ticker'],
+        'Name': raw['Name'],
+        # Only a handful of distinct sectors, so store them as integer category codes
+        'Sector': pd.Categorical(raw['Sector']),
+        'Composite Rank': ranks['Composite Rank'],
+        'Rank Percentage': rank_percentage,
+        'Value Rank': ranks['Value Rank'],
+        'Quality Rank': ranks['Quality Rank'],
+        'Momentum Rank': ranks['Momentum Rank'],
+        'Volatility Rank': ranks['Volatility Rank'],
+        'Business Profile': raw['Business Profile']
+    })
+
+# Build the fully ranked DataFrame, cached for a day so reruns skip the fetch and ranking. An incomplete
+# fetch raises instead, so Streamlit does not memoize it for the day
+@st.cache_data(ttl=86400)
+def build_ranking_df() -> pd.DataFrame:
+    raw, failed = load_stock_data()
+    total = len(raw) + failed
+    if too_many_failures(failed, total):
+        raise IncompleteFetchError(
+            f"Yahoo Finance data could not be fetched for {failed} of {total} stocks, so the rankings below "
+            f"cover only the remaining stocks. The fetch is retried every {FETCH_TTL // 60} minutes."
+        )
+    return rank_stocks(raw)
+
+# Split ranked stocks into one DataFrame per sector
+def group_by_sector(df: pd.DataFrame) -> dict:
+    return {sector: group.reset_index(drop=True) for sector, group in df.groupby('Sector', observed=True, sort=False)}
+
+# Split the ranked stocks by sector once, so switching sectors is a dictionary lookup. Cached as a
+# resource so reruns neither hash a DataFrame argument nor unpickle copies; callers must not mutate it
+@st.cache_resource(ttl=86400)
+def sector_index() -> dict:
+    return group_by_sector(build_ranking_df())
 
 # Streamlit app
 st.title("S&P 500 Stock Ranking by Vantage Capital")
 
+try:
+    df = build_ranking_df()
+    sectors = sector_index()
+except IncompleteFetchError as exc:
+    # Rank the partial fetch for this rerun only; ranking is cheap and the fetch itself stays cached briefly
+    raw, failed = load_stock_data()
+    if raw.empty:
+        st.error(f"Yahoo Finance data could not be fetched for any of the {failed} stocks. Please try again later.")
+        st.stop()
+    st.warning(str(exc))
+    df = rank_stocks(raw)
+    sectors = group_by_sector(df)
+
 st.write("""
 ### Vantage Capital Quantitative Stock Selection Model
 
@@ -109,29 +277,31 @@ The composite score is a weighted average of the four factors, providing a compr
 """)
 
 # Sector filter
-selected_sector = st.selectbox("Select Sector", options=['All'] + list(df['Sector'].unique()))
-if selected_sector != 'All':
-    df = df[df['Sector'] == selected_sector]
+selected_sector = st.selectbox("Select Sector", options=['All'] + list(sectors))
+df = sectors.get(selected_sector, df)
 
 # Display the DataFrame with default sorting by Composite Rank
 st.write("### Stock Data")
-st.dataframe(df.sort_values(by='Composite Rank', ascending=True).style.format({
+# The business profile is long free text, so it is shown in the company profile instead
+st.dataframe(df.drop(columns='Business Profile').sort_values(by='Composite Rank', ascending=True).style.format({
     'Composite Rank': '{:,.0f}',
     'Value Rank': '{:,.0f}',
     'Quality Rank': '{:,.0f}',
     'Momentum Rank': '{:,.0f}',
     'Volatility Rank': '{:,.0f}'
-}), use_container_width=True)
-
-# Display company profile based on click event
-selected_company = st.selectbox("Click on a company name to view its profile", df['Name'].tolist())
-
-# Display company profile
-if selected_company:
-    selected_data = df[df['Name'] == selected_company]
-    description = selected_data['Business Profile'].values[0]
-    sector = selected_data['Sector'].values[0]
-    st.write(f"### Company Profile")
-    st.write(f"**Company Name:** {selected_company}")
-    st.write(f"**Sector:** {sector}")
-    st.write(f"**Business Profile:** {description}")
+}, na_rep=''), use_container_width=True)
+
+# Display company profile based on click event, selecting by row so companies sharing a name stay distinct
+selected_row = st.selectbox(
+    "Click on a company name to view its profile", df.index, format_func=lambda i: df.at[i, 'Name']
+)
+
+# Display company profile from the cached row in a single message
+if selected_row is not None:
+    row = df.loc[selected_row]
+    st.markdown(
+        "### Company Profile\n\n"
+        f"**Company Name:** {row['Name']} ({row['Ticker']})\n\n"
+        f"**Sector:** {row['Sector']}\n\n"
+        f"**Business Profile:** {row['Business Profile']}"
+    )